@@ -52,8 +52,24 @@ Workload = namedtuple(
 
 def _get_workload(data, kernel, stride, padding, dilation, out_dtype):
     """ Get the workload structure. """
-    _, in_channel, height, width = [x.value for x in data.shape]
-    channel, channel_multiplier, kh, kw = [x.value for x in kernel.shape]
+    return _get_workload_from_shapes(
+        [x.value for x in data.shape],
+        data.dtype,
+        [x.value for x in kernel.shape],
+        kernel.dtype,
+        stride,
+        padding,
+        dilation,
+        out_dtype,
+    )
+
+
+def _get_workload_from_shapes(
+    data_shape, data_dtype, kernel_shape, kernel_dtype, stride, padding, dilation, out_dtype
+):
+    """ Get the workload structure from constant NCHW data and OIHW kernel shapes. """
+    _, in_channel, height, width = data_shape
+    channel, channel_multiplier, kh, kw = kernel_shape
     out_channel = channel * channel_multiplier
     dilation_h, dilation_w = (
         dilation if isinstance(dilation, (tuple, list)) else (dilation, dilation)
@@ -62,17 +78,17 @@ def _get_workload(data, kernel, stride, padding, dilation, out_dtype):
         HSTR, WSTR = stride
     else:
         HSTR, WSTR = stride, stride
-    assert (data.dtype == kernel.dtype) or (
-        data.dtype == "uint8" and kernel.dtype == "int8"
+    assert (data_dtype == kernel_dtype) or (
+        data_dtype == "uint8" and kernel_dtype == "int8"
     ), "Do not support inputs with different data types now. ' \
         '{} vs. {}".format(
-        data.dtype, kernel.dtype
+        data_dtype, kernel_dtype
     )
     dilated_kernel_h = (kh - 1) * dilation_h + 1
     dilated_kernel_w = (kw - 1) * dilation_w + 1
     pt, pl, pb, pr = get_pad_tuple(padding, (dilated_kernel_h, dilated_kernel_w))
     return Workload(
-        data.dtype,
+        data_dtype,
         out_dtype,
         height,
         width,
@@ -17,17 +17,28 @@
 # pylint: disable=invalid-name,unused-variable,unused-argument,no-member
 # pylint: disable=no-value-for-parameter
 """Depthwise Conv2D schedule on x86"""
+import functools
+import math
+
 import tvm
 from tvm import te
 from tvm import autotvm
 from tvm.autotvm.task.space import SplitEntity, OtherOptionEntity
+from .. import nn, tag
 from ..nn.pad import pad
 from ..utils import get_const_tuple
 from ..nn.utils import get_pad_tuple
-from ..nn.depthwise_conv2d import _get_workload, depthwise_conv2d_infer_layout
+from ..nn.depthwise_conv2d import _get_workload_from_shapes, depthwise_conv2d_infer_layout
 from ..nn.conv2d import unpack_NCHWc_to_nchw
 from ..utils import traverse_inline
-from .utils import get_fp32_len
+from .utils import get_fp32_len, get_simd_fp32_lanes, get_simd_register_count
+from .tensor_intrin import depthwise_3x3_fma
+
+# tag of the depthwise NCHWc compute, matched exactly by the schedule
+_DW_TAG = "depthwise_conv2d_NCHWc"
+
+# kernel sizes whose reduction is always fully unrolled by the NCHWc schedule
+_UNROLLED_KERNEL_SIZES = ((1, 1), (3, 3), (5, 5))
 
 
 def _fallback_schedule(cfg, wkl):
@@ -41,6 +52,9 @@ def _fallback_schedule(cfg, wkl):
         Convolution workload
     """
     simd_width = get_fp32_len()
+    if wkl.in_dtype == "float16":
+        # a vector load of half precision data covers twice as many channels
+        simd_width *= 2
 
     pt, pl, pb, pr = wkl.padt, wkl.padl, wkl.padb, wkl.padr
     HSTR, WSTR = wkl.stride_h, wkl.stride_w
@@ -48,23 +62,10 @@ def _fallback_schedule(cfg, wkl):
 
     out_width = (wkl.width - dilated_kernel_w + pl + pr) // WSTR + 1
 
-    oc_bn = 1
-    for bn in range(simd_width, 0, -1):
-        if wkl.out_filter % bn == 0:
-            oc_bn = bn
-            break
-
-    ic_bn = 1
-    for bn in range(oc_bn, 0, -1):
-        if wkl.in_filter % bn == 0:
-            ic_bn = bn
-            break
-
-    reg_n = 1
-    for n in range(31, 0, -1):
-        if out_width % n == 0:
-            reg_n = n
-            break
+    oc_bn = math.gcd(wkl.out_filter, simd_width)
+    ic_bn = math.gcd(wkl.in_filter, oc_bn)
+    reg_budget = _max_reg_n(oc_bn)
+    reg_n = max(n for n in range(1, reg_budget + 1) if out_width % n == 0)
 
     cfg["tile_ic"] = SplitEntity([wkl.in_filter // ic_bn, ic_bn])
     cfg["tile_oc"] = SplitEntity([wkl.out_filter // oc_bn, oc_bn])
@@ -72,6 +73,30 @@ def _fallback_schedule(cfg, wkl):
     cfg["unroll_kw"] = OtherOptionEntity(False)
 
 
+def _max_reg_n(c_bn):
+    """Get the number of output columns of a c_bn channel block to accumulate in
+    SIMD registers, leaving room for the kernel vectors streamed in one at a time"""
+    return get_simd_register_count() // (c_bn // get_simd_fp32_lanes() + 1)
+
+
+def _micro_kernel_reg_n(c_bn):
+    """Get the number of output columns the 3x3 micro-kernel can accumulate in
+    SIMD registers while its 9 kernel taps stay live in registers as well"""
+    vec_per_block = -(-c_bn // get_simd_fp32_lanes())
+    return get_simd_register_count() // vec_per_block - 9
+
+
+@functools.lru_cache(maxsize=512)
+def _workload_from_shapes(
+    data_shape, data_dtype, kernel_shape, kernel_dtype, strides, padding, dilation, out_dtype
+):
+    """Memoized _get_workload_from_shapes keyed on plain shape and dtype tuples,
+    so repeated compute invocations of the same layer are free"""
+    return _get_workload_from_shapes(
+        data_shape, data_dtype, kernel_shape, kernel_dtype, strides, padding, dilation, out_dtype
+    )
+
+
 def depthwise_conv2d_nchw(data, kernel, strides, padding, dilation, out_dtype):
     """Compute depthwise conv2d with NCHW layout."""
     layout = "NCHW"
@@ -101,6 +126,9 @@ def _pack_data(cfg, data, kernel):
         name="data_vec",
     )
 
+    # keep the unit axes of the OIHW1i[x]o layout that alter_op_layout hands over,
+    # so that tuning measures the same kernel rank that is deployed. The unit axes
+    # do not change the memory layout of the packed kernel.
     kernel = te.compute(
         (oc_chunk, 1, kh, kw, 1, oc_bn),
         lambda occ, icc, k_h, k_w, icb, ocb: kernel[
@@ -156,18 +184,25 @@ def depthwise_conv2d_NCHWc(
 
     cfg.define_split("tile_ic", in_channel, num_outputs=2)
     cfg.define_split("tile_oc", out_channel, num_outputs=2)
-    cfg.define_split("tile_ow", out_width, num_outputs=2, filter=lambda y: y.size[-1] <= 64)
-    cfg.define_knob("unroll_kw", [True, False])
+    max_vec_regs = get_simd_register_count()
+    cfg.define_split(
+        "tile_ow", out_width, num_outputs=2, filter=lambda y: y.size[-1] <= max_vec_regs
+    )
+    # unroll_kw only matters when the reduction is not fully unrolled anyway
+    if (filter_height, filter_width) in _UNROLLED_KERNEL_SIZES:
+        cfg.define_knob("unroll_kw", [False])
+    else:
+        cfg.define_knob("unroll_kw", [True, False])
 
     # get workload and related schedule config
-    wkl = _get_workload(
-        te.placeholder((batch, in_channel, in_height, in_width), dtype=data.dtype),
-        te.placeholder(
-            (out_channel, channel_multiplier, filter_height, filter_width), dtype=kernel.dtype
-        ),
-        strides,
+    wkl = _workload_from_shapes(
+        (batch, in_channel, in_height, in_width),
+        data.dtype,
+        (out_channel, channel_multiplier, filter_height, filter_width),
+        kernel.dtype,
+        tuple(strides),
         (pad_top, pad_down),
-        dilation,
+        (dh, dw),
         out_dtype,
     )
     if cfg.is_fallback:
@@ -204,30 +239,37 @@ def depthwise_conv2d_NCHWc(
     idxdiv = tvm.tir.indexdiv
     idxmod = tvm.tir.indexmod
 
+    def _data_at(b, oco, oci, h, w):
+        if in_channel_block == out_channel_block:
+            # every output channel reads the input channel at the same position,
+            # keep the channel remap out of the reduction body
+            return data_pad[b, oco, h, w, oci]
+        ic = oco * out_channel_block + oci
+        return data_pad[b, idxdiv(ic, in_channel_block), h, w, idxmod(ic, in_channel_block)]
+
     kh = te.reduce_axis((0, filter_height), name="kh")
     kw = te.reduce_axis((0, filter_width), name="kw")
+    # half precision inputs halve the memory traffic but accumulate in float32
+    accum_dtype = "float32" if out_dtype == "float16" else out_dtype
     Output = te.compute(
         (batch, out_channel_chunk, out_height, out_width, out_channel_block),
         lambda b, oco, oh, ow, oci: te.sum(
             (
-                data_pad[
-                    b,
-                    idxdiv(
-                        idxdiv(oco * out_channel_block + oci, channel_multiplier), in_channel_block
-                    ),
-                    oh * HSTR + kh * dh,
-                    ow * WSTR + kw * dw,
-                    idxmod(
-                        idxdiv(oco * out_channel_block + oci, channel_multiplier), in_channel_block
-                    ),
-                ].astype(out_dtype)
-                * kernel[oco, 0, kh, kw, 0, oci].astype(out_dtype)
+                _data_at(b, oco, oci, oh * HSTR + kh * dh, ow * WSTR + kw * dw).astype(accum_dtype)
+                * kernel[oco, 0, kh, kw, 0, oci].astype(accum_dtype)
             ),
             axis=[kh, kw],
         ),
         name="DepthwiseConv2d",
-        tag="depthwise_conv2d_NCHWc",
+        tag=_DW_TAG,
     )
+    if accum_dtype != out_dtype:
+        Output = te.compute(
+            Output.shape,
+            lambda *idx: Output(*idx).astype(out_dtype),
+            name="DepthwiseConv2dCast",
+            tag=tag.ELEMWISE,
+        )
     return Output
 
 
@@ -235,72 +277,249 @@ def depthwise_conv2d_NCHWc(
 def schedule_depthwise_conv2d_NCHWc(cfg, outs):
     """CPU schedule for depthwise conv2d in NCHW[x]c layout"""
     outs = [outs] if isinstance(outs, te.tensor.Tensor) else outs
-    s = te.create_schedule([x.op for x in outs])
+    out_ops = [x.op for x in outs]
+
+    # walk the injective chain above the conv with a worklist rather than
+    # recursion, so long elementwise epilogues cannot hit the recursion limit,
+    # and only collect the ops to schedule before the schedule is created
+    inline_ops, conv_ops = [], []
+    stack = [outs[0].op]
+    visited = set()
+    while stack:
+        op = stack.pop()
+        if op in visited:
+            continue
+        visited.add(op)
+        if tag.is_injective(op.tag):
+            if op not in out_ops:
+                inline_ops.append(op)
+            stack.extend(t.op for t in op.input_tensors if isinstance(t.op, te.ComputeOp))
+        if op.tag == _DW_TAG:
+            conv_ops.append(op)
+
+    s = te.create_schedule(out_ops)
+    for op in inline_ops:
+        s[op].compute_inline()
+    for op in conv_ops:
+        conv_out = op.output(0)
+        data = conv_out.op.input_tensors[0]
+        kernel = conv_out.op.input_tensors[1]
+        _schedule_depthwise_conv2d_NCHWc_impl(s, cfg, data, kernel, conv_out, outs[0])
+    return s
 
-    def _callback(op):
-        """Traverse operators from computation graph"""
-        if "depthwise_conv2d_NCHWc" in op.tag:
-            conv_out = op.output(0)
-            data = conv_out.op.input_tensors[0]
-            kernel = conv_out.op.input_tensors[1]
-            _schedule_depthwise_conv2d_NCHWc_impl(s, cfg, data, kernel, conv_out, outs[0])
 
-    traverse_inline(s, outs[0].op, _callback)
-    return s
+def _micro_kernel_block(data_vec, kernel_vec, conv_out):
+    """Get the channel block of the packed conv if it can be tensorized with the
+    3x3 stride-1 micro-kernel, otherwise return None"""
+    _, _, in_height, in_width, ic_bn = get_const_tuple(data_vec.shape)
+    _, _, kh, kw, _, oc_bn = get_const_tuple(kernel_vec.shape)
+    _, _, out_height, out_width, _ = get_const_tuple(conv_out.shape)
+    # with a 3x3 kernel the padded input is 2 larger than the output
+    # only if both stride and dilation are 1
+    if (
+        kh == 3
+        and kw == 3
+        and in_height - out_height == 2
+        and in_width - out_width == 2
+        and out_height > 1
+        and out_width > 1
+        and ic_bn == oc_bn
+        and oc_bn in (4, 8, 16)
+        # the taps only pay off when they are reused by several outputs
+        and _micro_kernel_reg_n(oc_bn) >= 2
+        and data_vec.dtype == kernel_vec.dtype == conv_out.dtype == "float32"
+    ):
+        return oc_bn
+    return None
+
+
+def _vectorize_channel_block(stage, ow_block, c_block, tile_ow, c_bn):
+    """Vectorize the channel block of a stage. When the channel block is narrower
+    than a SIMD register, the ow block is fused into the vector lanes so that
+    one vector covers several contiguous output columns. Returns the remaining
+    ow loop outside the vector lanes."""
+    simd_width = get_fp32_len()
+    if c_bn < simd_width and tile_ow * c_bn % simd_width == 0:
+        fused = stage.fuse(ow_block, c_block)
+        ow_block, c_block = stage.split(fused, factor=simd_width)
+    stage.vectorize(c_block)
+    return ow_block
 
 
 def _schedule_depthwise_conv2d_NCHWc_impl(s, cfg, data_vec, kernel_vec, conv_out, output):
-    tile_ow, oc_bn = cfg["tile_ow"].size[-1], cfg["tile_oc"].size[-1]
+    tile_ow = cfg["tile_ow"].size[-1]
+    # the channel block comes from the packed output, a pre-packed kernel
+    # is not bound to the block of the config
+    oc_bn = get_const_tuple(conv_out.shape)[-1]
     unroll_kw = cfg["unroll_kw"].val
 
-    # schedule pad
-    if isinstance(s[data_vec].op, tvm.te.ComputeOp) and "pad" in data_vec.op.tag:
-        batch, ic_chunk, ih, iw, ic_block = s[data_vec].op.axis
-        s[data_vec].vectorize(ic_block)
-        parallel_axis = s[data_vec].fuse(batch, ic_chunk, ih)
-        s[data_vec].parallel(parallel_axis)
-
     C, O = conv_out, output
     CC = s.cache_write(C, "global")
 
-    _, ic_chunk, oh, ow, ic_block = s[C].op.axis
+    batch, ic_chunk, oh, ow, ic_block = s[C].op.axis
     ow_chunk, ow_block = s[C].split(ow, factor=tile_ow)
-    s[C].reorder(ic_chunk, oh, ow_chunk, ow_block, ic_block)
-    s[C].vectorize(ic_block)
-    parallel_axis = s[C].fuse(ic_chunk, oh)
+    s[C].reorder(batch, ic_chunk, oh, ow_chunk, ow_block, ic_block)
+    _vectorize_channel_block(s[C], ow_block, ic_block, tile_ow, oc_bn)
+    parallel_axis = s[C].fuse(batch, ic_chunk, oh)
     s[C].parallel(parallel_axis)
     s[CC].compute_at(s[C], ow_chunk)
 
     # the ow axis in the cached block CC is the ow_block in C
     _, ic_chunk, oh, ow, ic_block = s[CC].op.axis
     kh, kw = s[CC].op.reduce_axis
-    s[CC].reorder(ic_chunk, oh, kh, kw, ow, ic_block)
-    if unroll_kw:
-        s[CC].unroll(kw)
-    s[CC].vectorize(ic_block)
-    s[CC].unroll(ow)
+    micro_bn = _micro_kernel_block(data_vec, kernel_vec, conv_out)
+    # only keep as many output columns in flight as there are SIMD registers for,
+    # the micro-kernel additionally holds all of its kernel taps in registers
+    if micro_bn is not None:
+        max_regs = _micro_kernel_reg_n(micro_bn)
+    else:
+        max_regs = _max_reg_n(oc_bn)
+    reg_n = max(n for n in range(1, max_regs + 1) if tile_ow % n == 0)
+    outer_axes = [ic_chunk, oh]
+    if reg_n < tile_ow:
+        ow_outer, ow = s[CC].split(ow, factor=reg_n)
+        outer_axes.append(ow_outer)
+
+    if micro_bn is not None:
+        # keep the 9 kernel taps in registers and stream the ow tile through them,
+        # the lanes follow the packed kernel, which is not always the tuned block
+        s[CC].reorder(*outer_axes, ow, kh, kw, ic_block)
+        intrin = depthwise_3x3_fma(reg_n, micro_bn, conv_out.dtype)
+        s[CC].tensorize(ow, intrin)
+    else:
+        s[CC].reorder(*outer_axes, kh, kw, ow, ic_block)
+        if (kh.dom.extent.value, kw.dom.extent.value) in _UNROLLED_KERNEL_SIZES:
+            # fully unroll the taps of the common kernel sizes so that every
+            # kernel load is an independent expression after lowering
+            s[CC].unroll(kh)
+            s[CC].unroll(kw)
+        elif unroll_kw:
+            s[CC].unroll(kw)
+        ow = _vectorize_channel_block(s[CC], ow, ic_block, reg_n, oc_bn)
+        s[CC].unroll(ow)
+
+    # compute the padded tile right before it is consumed instead of
+    # materializing the whole padded input in a separate parallel pass
+    if "pad" in data_vec.op.tag:
+        s[data_vec].compute_at(s[CC], oh)
+        s[data_vec].vectorize(s[data_vec].op.axis[-1])
+        kernel_h = get_const_tuple(kernel_vec.shape)[2]
+        if kernel_h > 1:
+            # the tile spans the kh input rows of one output row, prefetch the rows
+            # one tile further down, which the next output rows of the thread read.
+            # The offset is only applied to a loop starting at zero, the single part
+            # split rebases the row loop of the attached tile
+            _, tile_row = s[data_vec].split(s[data_vec].op.axis[2], nparts=1)
+            s[data_vec].prefetch(data_vec.op.input_tensors[0], tile_row, kernel_h)
 
     if C != O:
         out_ndim = len(s[O].op.axis)
         if out_ndim == 5:
             batch, oc_chunk, oh, ow, oc_block = s[O].op.axis
             ow_chunk, ow_block = s[O].split(ow, factor=tile_ow)
-            s[O].reorder(oc_chunk, oh, ow_chunk, ow_block, oc_block)
-            parallel_axis = s[O].fuse(oc_chunk, oh)
-            s[C].compute_at(s[O], parallel_axis)
-            s[O].vectorize(oc_block)
-            s[O].parallel(parallel_axis)
+            s[O].reorder(batch, oc_chunk, oh, ow_chunk, ow_block, oc_block)
         elif out_ndim == 4:
             batch, oc, oh, ow = s[O].op.axis
             ow_chunk, ow_block = s[O].split(ow, factor=tile_ow)
             oc_chunk, oc_block = s[O].split(oc, factor=oc_bn)
-            s[O].reorder(oc_chunk, oh, ow_chunk, ow_block, oc_block)
-            parallel_axis = s[O].fuse(oc_chunk, oh)
-            s[C].compute_at(s[O], parallel_axis)
-            s[O].vectorize(oc_block)
-            s[O].parallel(parallel_axis)
+            s[O].reorder(batch, oc_chunk, oh, ow_chunk, ow_block, oc_block)
         else:
             raise ValueError("Unsupported output ndim: %s" % out_ndim)
+        parallel_axis = s[O].fuse(batch, oc_chunk, oh)
+        if oc_bn % get_fp32_len() == 0:
+            # the fused epilogue consumes whole vectors, keep each conv tile
+            # in cache and apply the epilogue right after it is produced
+            s[C].compute_at(s[O], ow_chunk)
+            s[O].unroll(ow_block)
+        else:
+            s[C].compute_at(s[O], parallel_axis)
+        s[O].vectorize(oc_block)
+        s[O].parallel(parallel_axis)
+
+    return s
+
+
+@autotvm.register_topi_compute("depthwise_conv2d_nhwc.x86")
+def depthwise_conv2d_nhwc(cfg, data, kernel, strides, padding, dilation, out_dtype=None):
+    """Compute depthwise conv2d with NHWC layout"""
+    out = nn.depthwise_conv2d_nhwc(data, kernel, strides, padding, dilation, out_dtype)
+    _, _, out_width, out_channel = get_const_tuple(out.shape)
+
+    cfg.define_split("tile_c", out_channel, num_outputs=2)
+    max_vec_regs = get_simd_register_count()
+    cfg.define_split(
+        "tile_ow", out_width, num_outputs=2, filter=lambda y: y.size[-1] <= max_vec_regs
+    )
+    if cfg.is_fallback:
+        simd_width = get_fp32_len()
+        c_bn = math.gcd(out_channel, simd_width)
+        reg_budget = _max_reg_n(c_bn)
+        reg_n = max(n for n in range(1, reg_budget + 1) if out_width % n == 0)
+        cfg["tile_c"] = SplitEntity([out_channel // c_bn, c_bn])
+        cfg["tile_ow"] = SplitEntity([out_width // reg_n, reg_n])
+    return out
+
+
+@autotvm.register_topi_schedule("depthwise_conv2d_nhwc.x86")
+def schedule_depthwise_conv2d_nhwc(cfg, outs):
+    """CPU schedule for depthwise conv2d in NHWC layout"""
+    outs = [outs] if isinstance(outs, te.tensor.Tensor) else outs
+    s = te.create_schedule([x.op for x in outs])
+
+    def _callback(op):
+        """Traverse operators from computation graph"""
+        if op.tag == "depthwise_conv2d_nhwc":
+            _schedule_depthwise_conv2d_nhwc_impl(s, cfg, op.output(0), outs[0])
+
+    traverse_inline(s, outs[0].op, _callback)
+    return s
+
+
+def _schedule_depthwise_conv2d_nhwc_impl(s, cfg, conv_out, output):
+    tile_ow, c_bn = cfg["tile_ow"].size[-1], cfg["tile_c"].size[-1]
+    data_pad = conv_out.op.input_tensors[0]
+
+    C, O = conv_out, output
+    CC = s.cache_write(C, "global")
+
+    batch, oh, ow, c = s[C].op.axis
+    ow_chunk, ow_block = s[C].split(ow, factor=tile_ow)
+    c_chunk, c_block = s[C].split(c, factor=c_bn)
+    s[C].reorder(batch, oh, ow_chunk, c_chunk, ow_block, c_block)
+    s[C].vectorize(c_block)
+    parallel_axis = s[C].fuse(batch, oh)
+    s[C].parallel(parallel_axis)
+    s[CC].compute_at(s[C], c_chunk)
+
+    # the ow and c axes in the cached block CC are the ow_block and c_block in C
+    batch, oh, ow, c = s[CC].op.axis
+    kh, kw = s[CC].op.reduce_axis
+    # the taps are streamed one at a time, only the accumulators of the unrolled
+    # output columns stay in registers, the same budget the fallback tiles by
+    max_regs = _max_reg_n(c_bn)
+    reg_n = max(n for n in range(1, max_regs + 1) if tile_ow % n == 0)
+    if reg_n < tile_ow:
+        ow_outer, ow = s[CC].split(ow, factor=reg_n)
+        s[CC].reorder(batch, oh, ow_outer, kh, kw, ow, c)
+    else:
+        s[CC].reorder(batch, oh, kh, kw, ow, c)
+    s[CC].unroll(kw)
+    s[CC].vectorize(c)
+    s[CC].unroll(ow)
+
+    if "pad" in data_pad.op.tag:
+        s[data_pad].compute_at(s[CC], oh)
+        s[data_pad].vectorize(s[data_pad].op.axis[-1])
+
+    if C != O:
+        batch, oh, ow, c = s[O].op.axis
+        ow_chunk, ow_block = s[O].split(ow, factor=tile_ow)
+        c_chunk, c_block = s[O].split(c, factor=c_bn)
+        s[O].reorder(batch, oh, ow_chunk, c_chunk, ow_block, c_block)
+        parallel_axis = s[O].fuse(batch, oh)
+        s[C].compute_at(s[O], c_chunk)
+        s[O].vectorize(c_block)
+        s[O].parallel(parallel_axis)
 
     return s
 
@@ -326,3 +326,117 @@ def dot_16x1x16_uint8_int8_int32_cascadelake():
         binds={data: a_buffer, kernel: b_buffer},
         default_buffer_params=buffer_params,
     )
+
+
+def depthwise_3x3_fma(reg_n, c_bn, dtype="float32"):
+    """
+    Depthwise 3x3 stride-1 micro-kernel over a register tile of outputs.
+    This function takes a padded data tile data[3][reg_n + 2][c_bn] and
+    kernel[3][3][1][c_bn] of the same datatype and computes reg_n output
+    vectors of c_bn lanes each.
+    The pseudo code is as follows.
+    .. code-block:: c
+        void depthwise_3x3_fma(float data[3][reg_n + 2][c_bn],
+                float kernel[3][3][1][c_bn], float output[reg_n][c_bn]){
+            for (int w = 0; w < reg_n; w++){
+                for (int c = 0; c < c_bn; c++){
+                    output[w][c] = 0;
+                    for (int i = 0; i < 3; i++){
+                        for (int j = 0; j < 3; j++){
+                            output[w][c] += data[i][w + j][c] * kernel[i][j][0][c];
+                        }
+                    }
+                }
+            }
+        }
+
+    The 9 kernel taps are loaded once into vector registers and reused for
+    every output in the tile, each accumulation being a fused multiply-add
+    (fmla on NEON, vfmadd on x86 with FMA). This function returns a
+    TensorIntrin that can be used to tensorize a schedule.
+
+    Parameters
+    ----------
+    reg_n : int
+        Number of output vectors computed by one invocation
+
+    c_bn : int
+        Number of channel lanes in each vector
+
+    dtype : str
+        Data type of data, kernel and output
+
+    Returns
+    -------
+    intrin : TensorIntrin
+        The 3x3 depthwise TensorIntrin that can be used in tensorizing schedule
+    """
+    vec_dtype = "%sx%d" % (dtype, c_bn)
+    data = te.placeholder((3, reg_n + 2, c_bn), dtype=dtype, name="data")
+    kernel = te.placeholder((3, 3, 1, c_bn), dtype=dtype, name="kernel")
+    kh = te.reduce_axis((0, 3), name="kh")
+    kw = te.reduce_axis((0, 3), name="kw")
+    C = te.compute(
+        (reg_n, c_bn),
+        lambda w, c: te.sum(data[kh, w + kw, c] * kernel[kh, kw, 0, c], axis=[kh, kw]),
+        name="C",
+    )
+
+    a_buffer = tvm.tir.decl_buffer(
+        data.shape,
+        dtype=dtype,
+        name="a_buffer",
+        offset_factor=1,
+        strides=[te.var("ldh"), te.var("ldw"), 1],
+    )
+    b_buffer = tvm.tir.decl_buffer(
+        kernel.shape,
+        dtype=dtype,
+        name="b_buffer",
+        offset_factor=1,
+        strides=[te.var("ldkh"), te.var("ldkw"), te.var("ldk"), 1],
+    )
+    c_buffer = tvm.tir.decl_buffer(
+        C.shape, dtype=dtype, name="c_buffer", offset_factor=1, strides=[te.var("ldc"), 1]
+    )
+
+    def _intrin_func(ins, outs):
+        def _instr(index):
+            ib = tvm.tir.ir_builder.create()
+            if index == 1:
+                for w in range(reg_n):
+                    ib.emit(outs[0].vstore([w, 0], tvm.tir.const(0, vec_dtype)))
+                return ib.get()
+
+            taps = [
+                ib.let("tap_%d_%d" % (i, j), ins[1].vload([i, j, 0, 0], vec_dtype))
+                for i in range(3)
+                for j in range(3)
+            ]
+            for w in range(reg_n):
+                if index == 0:
+                    acc = tvm.tir.const(0, vec_dtype)
+                else:
+                    acc = outs[0].vload([w, 0], vec_dtype)
+                for i in range(3):
+                    for j in range(3):
+                        acc = tvm.tir.call_intrin(
+                            vec_dtype,
+                            "tir.fma",
+                            ins[0].vload([i, w + j, 0], vec_dtype),
+                            taps[i * 3 + j],
+                            acc,
+                        )
+                ib.emit(outs[0].vstore([w, 0], acc))
+            return ib.get()
+
+        # body, reset, update
+        return _instr(0), _instr(1), _instr(2)
+
+    buffer_params = {"offset_factor": 1}
+    return te.decl_tensor_intrin(
+        C.op,
+        _intrin_func,
+        binds={data: a_buffer, kernel: b_buffer, C: c_buffer},
+        default_buffer_params=buffer_params,
+    )
@@ -24,3 +24,19 @@ def get_fp32_len():
     if mcpu in ("skylake-avx512", "cascadelake"):
         fp32_vec_len = 16
     return fp32_vec_len
+
+
+def get_simd_register_count():
+    """Number of architectural SIMD registers of the current target"""
+    target = tvm.target.Target.current()
+    if "arm_cpu" in target.keys or target.mcpu in ("skylake-avx512", "cascadelake"):
+        return 32
+    return 16
+
+
+def get_simd_fp32_lanes():
+    """Number of float32 lanes in one SIMD register of the current target"""
+    if "arm_cpu" in tvm.target.Target.current().keys:
+        # 128-bit NEON registers
+        return 4
+    return get_fp32_len()
@@ -50,6 +50,7 @@ _depthwise_conv2d_nchw_implement = {
 
 _depthwise_conv2d_nhwc_implement = {
     "generic": (topi.nn.depthwise_conv2d_nhwc, topi.generic.schedule_depthwise_conv2d_nhwc),
+    "cpu": (topi.x86.depthwise_conv2d_nhwc, topi.x86.schedule_depthwise_conv2d_nhwc),
     "arm_cpu": (
         topi.arm_cpu.compute_depthwise_conv2d_nhwc,
         topi.arm_cpu.schedule_depthwise_conv2d_nhwc,
@@ -402,11 +403,20 @@ def _transform_kernel(kernel, bn):
 
 
 def depthwise_conv2d_with_workload_NCHWc(
-    batch, in_channel, in_height, channel_multiplier, filter_height, stride, padding, dilation=1
+    batch,
+    in_channel,
+    in_height,
+    channel_multiplier,
+    filter_height,
+    stride,
+    padding,
+    dilation=1,
+    dtype="float32",
+    filter_width=None,
 ):
     in_width = in_height
     filter_channel = in_channel
-    filter_width = filter_height
+    filter_width = filter_height if filter_width is None else filter_width
     stride_h = stride_w = stride
 
     assert (
@@ -431,16 +441,27 @@ def depthwise_conv2d_with_workload_NCHWc(
             ic_block = bn
             break
 
+    if dtype == "int8":
+        # quantized layers take uint8 data and int8 weights and accumulate in int32
+        in_dtype, filter_dtype, out_dtype = "uint8", "int8", "int32"
+    else:
+        in_dtype = filter_dtype = out_dtype = dtype
+
     # placeholder
     Input = te.placeholder(
-        (batch, in_channel // ic_block, in_height, in_width, ic_block), name="Input"
+        (batch, in_channel // ic_block, in_height, in_width, ic_block),
+        name="Input",
+        dtype=in_dtype,
     )
     Filter = te.placeholder(
-        (out_channel // oc_block, 1, filter_height, filter_width, 1, oc_block), name="Filter"
+        (out_channel // oc_block, 1, filter_height, filter_width, 1, oc_block),
+        name="Filter",
+        dtype=filter_dtype,
     )
     in_layout = "NCHW%dc" % ic_block
     out_layout = "NCHW%dc" % oc_block
-    dtype = "float32"
+    # half precision accumulates in float32 but rounds inputs and outputs
+    rtol = 1e-2 if dtype == "float16" else 1e-5
 
     def check_target(target):
         dev = tvm.device(target, 0)
@@ -458,7 +479,7 @@ def depthwise_conv2d_with_workload_NCHWc(
                 (dilation, dilation),
                 in_layout,
                 out_layout,
-                dtype,
+                out_dtype,
             )
             # TODO: add scale_shift implement for NCHWc and add test here
             Relu = topi.nn.relu(DepthwiseConv2d)
@@ -476,14 +497,19 @@ def depthwise_conv2d_with_workload_NCHWc(
         # Use memoize, pickle the test data for next time use.
         @memoize("topi.tests.test_topi_depthwise_conv2d.NCHWc")
         def get_ref_data():
-            input_np = np.random.uniform(size=input_shape).astype(dtype)
-            filter_np = np.random.uniform(size=filter_shape).astype(dtype)
+            if dtype == "int8":
+                input_np = np.random.randint(0, 32, size=input_shape).astype(in_dtype)
+                filter_np = np.random.randint(-16, 16, size=filter_shape).astype(filter_dtype)
+            else:
+                input_np = np.random.uniform(size=input_shape).astype(in_dtype)
+                filter_np = np.random.uniform(size=filter_shape).astype(filter_dtype)
             # correctness with scipy
             dw_np = tvm.topi.testing.dilate_python(filter_np, (1, 1, dilation, dilation)).astype(
-                dtype
+                filter_dtype
             )
+            # accumulate the reference in float32 rather than in the input type
             depthwise_conv2d_scipy = tvm.topi.testing.depthwise_conv2d_python_nchw(
-                input_np, dw_np, stride, padding
+                input_np.astype("float32"), dw_np.astype("float32"), stride, padding
             )
             relu_scipy = np.maximum(depthwise_conv2d_scipy, 0)
             return (
@@ -507,8 +533,8 @@ def depthwise_conv2d_with_workload_NCHWc(
         f1(input_tvm, filter_tvm, depthwise_conv2d_tvm)
         # launch kernel 2 (depthwise_conv2d + relu)
         f2(input_tvm, filter_tvm, relu_tvm)
-        tvm.testing.assert_allclose(depthwise_conv2d_tvm.numpy(), depthwise_conv2d_scipy, rtol=1e-5)
-        tvm.testing.assert_allclose(relu_tvm.numpy(), relu_scipy, rtol=1e-5)
+        tvm.testing.assert_allclose(depthwise_conv2d_tvm.numpy(), depthwise_conv2d_scipy, rtol=rtol)
+        tvm.testing.assert_allclose(relu_tvm.numpy(), relu_scipy, rtol=rtol)
 
     # test llvm only for now since depthwise_conv2d_NCHWc implement is missing in other backend.
     for target in ["llvm"]:
@@ -516,6 +542,45 @@ def depthwise_conv2d_with_workload_NCHWc(
             check_target(target)
 
 
+def test_depthwise_conv2d_NCHWc_prefetch():
+    """The padded input tile of x86 depthwise NCHW[x]c prefetches the input rows
+    of the following output rows"""
+    batch, in_channel, in_size, block, kernel_size = 1, 32, 28, 8, 3
+    pad_top = (kernel_size - 1) // 2
+    layout = "NCHW%dc" % block
+    Input = te.placeholder((batch, in_channel // block, in_size, in_size, block), name="Input")
+    Filter = te.placeholder(
+        (in_channel // block, 1, kernel_size, kernel_size, 1, block), name="Filter"
+    )
+    with tvm.target.Target("llvm"):
+        Output = topi.x86.depthwise_conv2d_NCHWc(
+            Input, Filter, (1, 1), "SAME", (1, 1), layout, layout, "float32"
+        )
+        s = topi.x86.schedule_depthwise_conv2d_NCHWc(Output)
+    mod = tvm.driver.build_module.form_irmodule(s, [Input, Filter, Output], "main", None)
+    mod = tvm.tir.transform.InjectPrefetch()(mod)
+
+    prefetches = []
+    tvm.tir.stmt_functor.post_order_visit(
+        mod["main"].body,
+        lambda node: prefetches.append(node) if isinstance(node, tvm.tir.Prefetch) else None,
+    )
+    assert len(prefetches) == 1
+    assert prefetches[0].buffer.name == Input.name
+
+    # in the first iteration of every loop the tile covers the input rows
+    # [-pad_top, kernel_size - pad_top), the prefetch has to start below them
+    row_min = prefetches[0].bounds[2].min
+    loop_vars = []
+    tvm.tir.stmt_functor.post_order_visit(
+        row_min, lambda node: loop_vars.append(node) if isinstance(node, tvm.tir.Var) else None
+    )
+    first_row = tvm.arith.Analyzer().simplify(
+        tvm.tir.stmt_functor.substitute(row_min, {v: tvm.tir.const(0, v.dtype) for v in loop_vars})
+    )
+    assert first_row.value >= kernel_size - pad_top
+
+
 @tvm.testing.uses_gpu
 def test_depthwise_conv2d():
     # mobilenet workloads
@@ -551,6 +616,16 @@ def test_depthwise_conv2d():
     depthwise_conv2d_with_workload_NCHWc(1, 728, 32, 1, 3, 1, "SAME", dilation=2)
     depthwise_conv2d_with_workload_NCHWc(1, 728, 32, 1, 3, 1, "SAME")
     depthwise_conv2d_with_workload_NCHWc(1, 728, 32, 1, 3, 1, "VALID")
+    depthwise_conv2d_with_workload_NCHWc(1, 32, 112, 1, 3, 1, "SAME")
+    # 8 and 4 lane blocks run the 3x3 micro-kernel over several outputs per call
+    depthwise_conv2d_with_workload_NCHWc(1, 8, 56, 1, 3, 1, "SAME")
+    depthwise_conv2d_with_workload_NCHWc(1, 4, 56, 1, 3, 1, "SAME")
+    # a single row kernel pads a tile of one input row
+    depthwise_conv2d_with_workload_NCHWc(1, 32, 28, 1, 1, 1, "SAME", filter_width=3)
+    depthwise_conv2d_with_workload_NCHWc(1, 64, 28, 1, 3, 1, "SAME", dtype="float16")
+    depthwise_conv2d_with_workload_NCHWc(1, 64, 28, 1, 3, 2, "VALID", dtype="float16")
+    depthwise_conv2d_with_workload_NCHWc(1, 32, 28, 1, 3, 1, "SAME", dtype="int8")
+    depthwise_conv2d_with_workload_NCHWc(1, 64, 28, 1, 3, 2, "VALID", dtype="int8")
 
     # Test compilation on arm targets
     compile_depthwise_NHWC_int8_arm(1, 728, 32, 1, 3, 1, "SAME")
@@ -559,3 +634,4 @@ def test_depthwise_conv2d():
 
 if __name__ == "__main__":
     test_depthwise_conv2d()
+    test_depthwise_conv2d_NCHWc_prefetch()